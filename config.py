@@ -0,0 +1,23 @@
+"""
+Environment settings for the webhook service (webhook_app, ocr_worker, sheets,
+user_registry), read once at import. The CLI tools keep their own env handling.
+"""
+
+import os
+import json
+
+# ================= TWILIO =================
+
+TWILIO_SID = os.getenv("TWILIO_ACCOUNT_SID")
+TWILIO_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
+
+# ================= GOOGLE =================
+
+DEFAULT_SHEET_ID = os.getenv("DEFAULT_SHEET_ID")
+
+# service-account JSON shared by Vision and Sheets; parsed once here
+_creds_raw = os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON")
+GOOGLE_CREDS = json.loads(_creds_raw) if _creds_raw else None
+
+# gzip Vision request bodies on the wire; set VISION_GRPC_GZIP=0 to turn off
+VISION_GRPC_GZIP = os.getenv("VISION_GRPC_GZIP", "1") == "1"
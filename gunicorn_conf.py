@@ -0,0 +1,24 @@
+"""
+Gunicorn settings for the webhook: gunicorn supervises the processes and each
+worker runs the FastAPI app on uvicorn's event loop.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# the app is I/O-bound and async, so a couple of workers go a long way. Each
+# worker has its own Sheets token buckets, OCR pool, Vision client and MessageSid
+# dedupe, so raising WEB_CONCURRENCY multiplies Sheets quota use accordingly
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+# uvicorn.workers.UvicornWorker is deprecated in favour of the uvicorn-worker package
+worker_class = "uvicorn_worker.UvicornWorker"
+
+# no preload_app: webhook_app starts its log listener thread at import, and
+# threads do not survive the fork into workers (the OCR stack loads lazily anyway)
+preload_app = False
+
+# Twilio and Google calls run in background tasks; leave them time to finish
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
@@ -5,49 +5,277 @@ NO Sheets
 """
 
 import os
-import json
+import io
+import contextlib
+import hashlib
+import tempfile
 import logging
 from pathlib import Path
+import grpc
+import orjson
+from PIL import Image, ImageOps
 from google.cloud import vision
+from google.cloud.vision_v1.services.image_annotator.transports import ImageAnnotatorGrpcTransport
 from google.oauth2 import service_account
+from config import GOOGLE_CREDS, VISION_GRPC_GZIP
 from parser import extract_fields
 
+# optional: lets text-native PDFs skip Vision entirely
+try:
+    import pypdfium2 as pdfium
+    _PDFIUM_ENABLED = True
+except Exception:
+    _PDFIUM_ENABLED = False
+
 logging.basicConfig(level=logging.INFO)
 
 OCR_DIR = Path("data/ocr")
 PARSED_DIR = Path("data/parsed")
 PROCESSED_DIR = Path("data/media/processed")
+# raw OCR text keyed by sha256 of the media bytes, so resent invoices skip Vision
+OCR_CACHE_DIR = Path("data/ocr_cache")
 
-for d in [OCR_DIR, PARSED_DIR, PROCESSED_DIR]:
+for d in [OCR_DIR, PARSED_DIR, PROCESSED_DIR, OCR_CACHE_DIR]:
     d.mkdir(parents=True, exist_ok=True)
 
+VISION_CLIENT = None
+
+def _gzip_channel(*args, **kwargs):
+    return ImageAnnotatorGrpcTransport.create_channel(
+        *args, compression=grpc.Compression.Gzip, **kwargs
+    )
+
 def get_vision_client():
-    creds = json.loads(os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON"))
-    credentials = service_account.Credentials.from_service_account_info(creds)
-    logging.info("🔥 USING VISION PROJECT ID: %s", creds.get("project_id"))
-    return vision.ImageAnnotatorClient(credentials=credentials)
+    # one client (and gRPC channel) per process, reused across files
+    global VISION_CLIENT
+    if VISION_CLIENT is None:
+        credentials = service_account.Credentials.from_service_account_info(GOOGLE_CREDS)
+        logging.info("🔥 USING VISION PROJECT ID: %s", GOOGLE_CREDS.get("project_id"))
+        if VISION_GRPC_GZIP:
+            transport = ImageAnnotatorGrpcTransport(
+                credentials=credentials, channel=_gzip_channel
+            )
+            VISION_CLIENT = vision.ImageAnnotatorClient(transport=transport)
+        else:
+            VISION_CLIENT = vision.ImageAnnotatorClient(credentials=credentials)
+    return VISION_CLIENT
 
-def process_file(image_path: Path) -> dict:
-    logging.info("Processing %s", image_path.name)
+# Vision accepts at most 16 images per batch_annotate_images call
+BATCH_SIZE = 16
+# ...and at most 5 pages per inline batch_annotate_files call
+PDF_PAGES_PER_CALL = 5
+# dense invoice layouts OCR better in document mode; hints skip language autodetect
+FEATURE = vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)
+IMAGE_CONTEXT = vision.ImageContext(language_hints=["en", "hi"])
+# a PDF text layer shorter than this is treated as a scan and OCR'd
+MIN_PDF_TEXT = 50
+# longest side sent to Vision; phone photos are often 4000px+
+MAX_IMAGE_SIDE = 2000
+
+def _read_media(path: Path) -> bytes:
+    """
+    Read a media file once, then drop it from the page cache: it is never read again.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    return data
+
+def _prepare(data: bytes) -> bytes:
+    """
+    Grayscale + downscale + re-encode, to cut upload size before OCR.
+    """
+    try:
+        # Pillow decodes lazily, so a truncated file only fails in convert/thumbnail
+        img = Image.open(io.BytesIO(data))
+        img = ImageOps.exif_transpose(img).convert("L")
+        img.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE), Image.LANCZOS)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # not something Pillow reads (or too large to decode safely); let Vision
+        # report on the raw bytes
+        return data
+
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
 
+def ocr_images(images: dict[Path, bytes]) -> list[str | None]:
+    """
+    OCR several images (path -> file bytes) with one Vision RPC per BATCH_SIZE images.
+    Returns the raw text for each image, or None where nothing was detected.
+    """
     client = get_vision_client()
-    image = vision.Image(content=image_path.read_bytes())
-    response = client.text_detection(image=image)
+    image_paths = list(images)
+    texts = []
 
-    if not response.text_annotations:
-        raise RuntimeError("No OCR text detected")
+    for i in range(0, len(image_paths), BATCH_SIZE):
+        chunk = image_paths[i:i + BATCH_SIZE]
+        batch = [
+            vision.AnnotateImageRequest(
+                image=vision.Image(content=_prepare(images[p])),
+                features=[FEATURE],
+                image_context=IMAGE_CONTEXT,
+            )
+            for p in chunk
+        ]
+        response = client.batch_annotate_images(requests=batch)
+
+        for path, res in zip(chunk, response.responses):
+            if res.error.message:
+                logging.warning("Vision error for %s: %s", path.name, res.error.message)
+            texts.append(res.text_annotations[0].description if res.text_annotations else None)
+
+    return texts
+
+def _pdf_text_layer(content: bytes) -> str:
+    pdf = pdfium.PdfDocument(content)
+    try:
+        return "\n".join(page.get_textpage().get_text_range() for page in pdf)
+    finally:
+        pdf.close()
+
+def ocr_pdf(pdf_path: Path, content: bytes) -> str | None:
+    """
+    OCR a PDF by sending it to Vision as-is; pages are rasterised server side.
+    E-invoices and portal exports already carry a text layer, which is used instead.
+    """
+    if _PDFIUM_ENABLED:
+        try:
+            text = _pdf_text_layer(content)
+        except Exception as e:
+            logging.warning("PDF text extraction failed for %s: %s", pdf_path.name, e)
+            text = ""
+        if len(text.strip()) > MIN_PDF_TEXT:
+            logging.info("📄 Using embedded text layer of %s", pdf_path.name)
+            return text
+
+    client = get_vision_client()
+    input_config = vision.InputConfig(
+        content=content, mime_type="application/pdf"
+    )
+    pages_text = []
+    # the page count is unknown until the first reply, so the first call leaves
+    # pages unset (Vision then takes pages 1-5); later calls name pages 6 onwards
+    pages, first = [], 1
 
-    raw_text = response.text_annotations[0].description
+    while True:
+        response = client.batch_annotate_files(
+            requests=[
+                vision.AnnotateFileRequest(
+                    input_config=input_config,
+                    features=[FEATURE],
+                    image_context=IMAGE_CONTEXT,
+                    pages=pages,
+                )
+            ]
+        )
+        file_res = response.responses[0]
+        if file_res.error.message:
+            logging.warning("Vision error for %s: %s", pdf_path.name, file_res.error.message)
+            break
 
+        pages_text += [r.full_text_annotation.text for r in file_res.responses]
+        first += PDF_PAGES_PER_CALL
+        if first > file_res.total_pages:
+            break
+        pages = list(range(first, min(first + PDF_PAGES_PER_CALL, file_res.total_pages + 1)))
+
+    raw_text = "\n".join(t for t in pages_text if t)
+    return raw_text or None
+
+# the cache only saves Vision calls: a failed read or write is logged, never raised
+
+def _cache_get(key: str) -> str | None:
+    path = OCR_CACHE_DIR / f"{key}.txt"
+    try:
+        return path.read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        logging.warning("OCR cache read failed for %s: %s", key, e)
+        return None
+
+def _cache_put(key: str, raw_text: str):
+    path = OCR_CACHE_DIR / f"{key}.txt"
+    # a unique temp file, so workers caching the same bytes at once don't collide
+    tmp = None
+    try:
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=OCR_CACHE_DIR, suffix=".tmp", delete=False
+        ) as f:
+            tmp = f.name
+            f.write(raw_text)
+        os.replace(tmp, path)
+    except OSError as e:
+        logging.warning("OCR cache write failed for %s: %s", key, e)
+        if tmp:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp)
+
+def _save_result(image_path: Path, raw_text: str) -> dict:
     (OCR_DIR / f"{image_path.stem}.txt").write_text(raw_text, encoding="utf-8")
 
     parsed = extract_fields(raw_text)
     parsed["raw_text"] = raw_text
 
-    (PARSED_DIR / f"{image_path.stem}.json").write_text(
-        json.dumps(parsed, indent=2), encoding="utf-8"
+    (PARSED_DIR / f"{image_path.stem}.json").write_bytes(
+        orjson.dumps(parsed, option=orjson.OPT_INDENT_2)
     )
 
-    image_path.rename(PROCESSED_DIR / image_path.name)
+    try:
+        image_path.rename(PROCESSED_DIR / image_path.name)
+    except FileNotFoundError:
+        # the webhook could not archive this media; OCR ran on its bytes anyway
+        logging.warning("No archived copy of %s to move", image_path.name)
+
+    return parsed
+
+def process_files(image_paths: list[Path], contents: list[bytes] | None = None) -> list[dict | None]:
+    """
+    Batched process_file: one parsed dict per path, None where OCR found no text.
+    Pass contents when the caller already holds the files' bytes, to skip reading them back.
+    """
+    for p in image_paths:
+        logging.info("Processing %s", p.name)
+
+    if contents is None:
+        contents = [_read_media(p) for p in image_paths]
+    contents = dict(zip(image_paths, contents))
+    keys = {p: hashlib.sha256(contents[p]).hexdigest() for p in image_paths}
+    texts = {}
+    for p in image_paths:
+        cached = _cache_get(keys[p])
+        if cached is not None:
+            logging.info("♻️ OCR cache hit for %s", p.name)
+            texts[p] = cached
+
+    misses = [p for p in image_paths if p not in texts]
+    images = {p: contents[p] for p in misses if p.suffix.lower() != ".pdf"}
+    if images:
+        # an all-cache-hit or all-PDF batch never needs the Vision client
+        texts.update(zip(images, ocr_images(images)))
+    for p in misses:
+        if p not in texts:
+            texts[p] = ocr_pdf(p, contents[p])
+        if texts[p]:
+            _cache_put(keys[p], texts[p])
+
+    results = []
+    for image_path in image_paths:
+        raw_text = texts[image_path]
+        if not raw_text:
+            logging.warning("No OCR text detected in %s", image_path.name)
+            results.append(None)
+            continue
+        results.append(_save_result(image_path, raw_text))
+
+    return results
+
+def process_file(image_path: Path) -> dict:
+    parsed = process_files([image_path])[0]
+
+    if parsed is None:
+        raise RuntimeError("No OCR text detected")
 
     return parsed
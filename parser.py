@@ -8,10 +8,12 @@ parser.py — Invoice Automation MVP (updated)
 """
 
 from pathlib import Path
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 import re
 import argparse
 import logging
-import json
+import orjson
 import os
 
 logging.basicConfig(
@@ -86,9 +88,19 @@ def _apply_header_formatting(sh, ws, header_len):
         print("Warning: failed to apply header formatting:", e)
 
 
+@lru_cache(maxsize=8)
+def _resolve_creds_path(creds_path):
+    """Expand env vars in the credentials path once per value; None if the file is missing."""
+    path = os.path.expandvars(creds_path)
+    return path if os.path.exists(path) else None
+
+
+@lru_cache(maxsize=8)
 def _get_sheet_and_ensure_header(creds_path, sheet_id, worksheet_name='Sheet1'):
-    """Return worksheet object + ensure header row exists or insert above data and format it."""
-    creds_path = os.path.expandvars(creds_path)
+    """
+    Return worksheet object + ensure header row exists or insert above data and format it.
+    Cached per (creds, sheet, worksheet) so the header is checked once per process.
+    """
     scopes = ['https://www.googleapis.com/auth/spreadsheets']
     creds = Credentials.from_service_account_file(creds_path, scopes=scopes)
     client = gspread.authorize(creds)
@@ -105,18 +117,18 @@ def _get_sheet_and_ensure_header(creds_path, sheet_id, worksheet_name='Sheet1'):
         'date', 'total', 'gst', 'raw_text'
     ]
 
+    # only row 1 matters here; don't download the whole sheet
     try:
-        values = ws.get_all_values()
+        first_row = ws.row_values(1)
     except Exception:
-        values = []
+        first_row = []
 
-    if not values:
+    if not first_row:
         # Sheet is empty => append header
         ws.append_row(header, value_input_option='USER_ENTERED')
         _apply_header_formatting(sh, ws, len(header))
     else:
         # If first row is not the header, insert header at top (Option A)
-        first_row = values[0]
         if first_row != header[:len(first_row)]:
             ws.insert_row(header, index=1)
             ws = sh.worksheet(worksheet_name)  # refresh
@@ -128,8 +140,39 @@ def _get_sheet_and_ensure_header(creds_path, sheet_id, worksheet_name='Sheet1'):
     return ws
 
 
-def append_to_google_sheet(parsed: dict):
-    """Append parsed row with duplicate protection + FORCE_APPEND override."""
+# (sheet_id, worksheet) -> files already in column B; read once per process
+_SEEN_FILES = {}
+
+
+def _seen_files(ws, sheet_id, worksheet_name):
+    key = (sheet_id, worksheet_name)
+    if key not in _SEEN_FILES:
+        _SEEN_FILES[key] = set(ws.col_values(2))  # Column B = file
+    return _SEEN_FILES[key]
+
+
+def _sheet_row(parsed: dict) -> list:
+    ts = datetime.utcnow().isoformat()
+    raw_text = parsed.get("raw_text", "")
+    raw_short = (raw_text[:1000] + "...") if len(raw_text) > 1000 else raw_text
+
+    return [
+        ts,
+        parsed.get("file", ""),
+        parsed.get("supplier", ""),
+        parsed.get("invoice_number", ""),
+        parsed.get("date", ""),
+        parsed.get("total", ""),
+        parsed.get("gst", ""),
+        raw_short
+    ]
+
+
+def append_rows_to_google_sheet(parsed_list: list):
+    """
+    Append many parsed rows in one API call, with duplicate protection + FORCE_APPEND override.
+    The dedupe column is fetched once per process and kept up to date locally.
+    """
     if not _GS_ENABLED:
         print("Google Sheets libs not installed; skipping Sheets export.")
         return False
@@ -142,10 +185,11 @@ def append_to_google_sheet(parsed: dict):
         print("Google Sheets not configured; skipping export.")
         return False
 
-    creds_path = os.path.expandvars(creds_path)
-    if not os.path.exists(creds_path):
-        print(f"Credentials not found at {creds_path}; skipping export.")
+    resolved = _resolve_creds_path(creds_path)
+    if resolved is None:
+        print(f"Credentials not found at {os.path.expandvars(creds_path)}; skipping export.")
         return False
+    creds_path = resolved
 
     # Get sheet + ensure header
     try:
@@ -155,63 +199,72 @@ def append_to_google_sheet(parsed: dict):
         return False
 
     # Dedupe logic with override
-    try:
-        _force_append = os.environ.get("GOOGLE_SHEET_FORCE_APPEND", "0") == "1"
-        all_vals = ws.col_values(2)  # Column B = file
-        if not _force_append and parsed.get("file") in all_vals:
-            print(f"Row for {parsed.get('file')} already exists — skipping.")
-            return True
-    except Exception:
-        pass
+    _force_append = os.environ.get("GOOGLE_SHEET_FORCE_APPEND", "0") == "1"
+    seen = set()
+    if not _force_append:
+        try:
+            seen = _seen_files(ws, sheet_id, worksheet_name)
+        except Exception:
+            pass
 
-    # Build row
-    ts = datetime.utcnow().isoformat()
-    raw_text = parsed.get("raw_text", "")
-    raw_short = (raw_text[:1000] + "...") if len(raw_text) > 1000 else raw_text
+    rows, files = [], set()
+    for parsed in parsed_list:
+        if not _force_append and (parsed.get("file") in seen or parsed.get("file") in files):
+            print(f"Row for {parsed.get('file')} already exists — skipping.")
+            continue
+        files.add(parsed.get("file"))
+        rows.append(_sheet_row(parsed))
 
-    row = [
-        ts,
-        parsed.get("file", ""),
-        parsed.get("supplier", ""),
-        parsed.get("invoice_number", ""),
-        parsed.get("date", ""),
-        parsed.get("total", ""),
-        parsed.get("gst", ""),
-        raw_short
-    ]
+    if not rows:
+        return True
 
-    # Append row
+    # Append rows
     try:
-        ws.append_row(row, value_input_option="USER_ENTERED")
-        print(f"Appended row to Google Sheet (worksheet: {worksheet_name})")
+        ws.append_rows(rows, value_input_option="USER_ENTERED")
+        print(f"Appended {len(rows)} row(s) to Google Sheet (worksheet: {worksheet_name})")
+        seen.update(files)
         return True
     except Exception as e:
-        print("Failed to append row:", e)
+        print("Failed to append rows:", e)
         return False
 
 
+def append_to_google_sheet(parsed: dict):
+    """Append parsed row with duplicate protection + FORCE_APPEND override."""
+    return append_rows_to_google_sheet([parsed])
+
+
 # -----------------------------
 # Robust field extraction (user-supplied)
 # -----------------------------
 
 # helper normalizers and money parsing
+_BLANKLINE_RE = re.compile(r'\n\s+\n')
+_OCR_O_RE = re.compile(r'\b\d+O\d+\b')
+_OCR_L_RE = re.compile(r'\b[lI]{2,}\b')
+_MONEY_JUNK_RE = re.compile(r'[^\d\.\-]')
+_MONEY_STRIP = str.maketrans('', '', '₹, ')
+
+
 def _norm_text(t: str) -> str:
     t = t.replace('\r', '\n')
-    t = re.sub(r'\n\s+\n', '\n', t)  # collapse spaced blank lines
-    # common OCR fixes
-    t = t.replace('O', '0') if re.search(r'\b\d+O\d+\b', t) else t
-    t = t.replace('l', '1') if re.search(r'\b[lI]{2,}\b', t) else t
+    t = _BLANKLINE_RE.sub('\n', t)  # collapse spaced blank lines
+    # common OCR fixes, applied only inside the offending tokens
+    if 'O' in t:
+        t = _OCR_O_RE.sub(lambda m: m.group(0).replace('O', '0'), t)
+    if 'l' in t or 'I' in t:
+        t = _OCR_L_RE.sub(lambda m: m.group(0).replace('l', '1'), t)
     return t
 
 
 def _clean_money(s: str):
     if not s:
         return None
-    s = s.strip()
     # replace common OCR noise
-    s = s.replace('₹', '').replace('Rs.', '').replace('Rs', '').replace('INR', '')
-    s = s.replace(',', '').replace(' ', '')
-    s = re.sub(r'[^\d\.\-]', '', s)  # keep digits, decimal, negative
+    if 'Rs' in s or 'INR' in s:
+        s = s.replace('₹', '').replace('Rs.', '').replace('Rs', '').replace('INR', '')
+    s = s.translate(_MONEY_STRIP)
+    s = _MONEY_JUNK_RE.sub('', s)  # keep digits, decimal, negative
     try:
         # prefer integer when decimal empty
         val = float(s) if '.' in s else float(int(s))
@@ -220,33 +273,60 @@ def _clean_money(s: str):
         return None
 
 
-# regex candidates
-_DATE_PATTERNS = [
+# regex candidates (compiled once at import; extract_fields runs per invoice)
+_DATE_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
     r'(\d{1,2}[\/\-]\d{1,2}[\/\-]\d{2,4})',
     r'(\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Sept|Oct|Nov|Dec)[a-z]*[,\s]*\d{2,4})',
     r'((?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Sept|Oct|Nov|Dec)[a-z]*\s+\d{1,2},?\s+\d{4})',
     r'(\d{4}[\/\-]\d{1,2}[\/\-]\d{1,2})'
+)]
+
+# separators are a single [:\-\s]* run: stacking \s* in front of it backtracks
+# cubically on long whitespace gaps in OCR text without changing what matches
+_INVOICE_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r'(?:invoice\s*(?:no|number|#|:)?[:\-\s]*)([A-Za-z0-9\-/\.]+)',
+    r'(?:inv(?:\.|)\s*(?:no|#)?[:\-\s]*)([A-Za-z0-9\-/\.]+)',
+    r'(?:bill\s*(?:no|#)?[:\-\s]*)([A-Za-z0-9\-/\.]+)',
+    r'(?:invoice)[:\-\s]*([A-Za-z0-9\-/\.]{3,30})'  # fallback
+)]
+
+_TOTAL_PATTERNS = [re.compile(p, re.IGNORECASE | re.M) for p in (
+    r'(grand total(?: amount)?|total amount after tax|total amount|amount due|total payable|invoice total|amount)[:\-\s]*(?:₹\s*)?([0-9,\.\s]+)',
+    r'(total)[:\-\s]*(?:₹\s*)?([0-9\.,,]+)$',  # trailing line
+)]
+
+_TOTAL_TAX_RE = re.compile(r'(total\s*tax[:\-\s]*)([0-9,\.\s]+)', re.IGNORECASE)
+_GST_COMPONENT_RE = re.compile(r'(cgst|sgst|igst)[^\d]*([0-9,\.\s]+)', re.IGNORECASE)
+_GST_LINE_PATTERNS = [
+    _TOTAL_TAX_RE,
+    re.compile(r'(taxable amount[:\-\s]*)([0-9,\.\s]+)', re.IGNORECASE),
+    _GST_COMPONENT_RE,
 ]
 
-_INVOICE_PATTERNS = [
-    r'(?:invoice\s*(?:no|number|#|:)?\s*[:\-\s]*)([A-Za-z0-9\-/\.]+)',
-    r'(?:inv(?:\.|)\s*(?:no|#)?\s*[:\-\s]*)([A-Za-z0-9\-/\.]+)',
-    r'(?:bill\s*(?:no|#)?\s*[:\-\s]*)([A-Za-z0-9\-/\.]+)',
-    r'(?:invoice)\s*[:\-\s]*([A-Za-z0-9\-/\.]{3,30})'  # fallback
-]
+_GSTIN_RE = re.compile(r'([0-9A-Z]{2}[A-Z0-9]{10})')  # simple GSTIN-ish capture
 
-_TOTAL_PATTERNS = [
-    r'(grand total(?: amount)?|total amount after tax|total amount|amount due|total payable|invoice total|amount)\s*[:\-\s]*₹?\s*([0-9,\.\s]+)',
-    r'(total)\s*[:\-\s]*₹?\s*([0-9\.,,]+)$',  # trailing line
-]
+_HEADING_RE = re.compile(r'\b(TAX INVOICE|TAXINVOICE|INVOICE|INVOICE NO|INVOICE#)\b')
+_MONEY_RE = re.compile(r'₹?\s*([0-9][0-9,\. ]{1,}[0-9])')
 
-_GST_LINE_PATTERNS = [
-    r'(total\s*tax[:\-\s]*)([0-9,\.\s]+)',
-    r'(taxable amount[:\-\s]*)([0-9,\.\s]+)',
-    r'(cgst|sgst|igst)[^\d]*([0-9,\.\s]+)'
-]
 
-_GSTIN_RE = re.compile(r'([0-9A-Z]{2}[A-Z0-9]{10})')  # simple GSTIN-ish capture
+# numeric dates from _DATE_PATTERNS, in the order dateutil's dayfirst=True
+# resolves them (year-first strings read as Y-D-M when the last part is <= 12)
+_FAST_DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%Y/%d/%m', '%Y-%d-%m', '%Y/%m/%d', '%Y-%m-%d')
+
+
+@lru_cache(maxsize=1024)
+def _fast_parse_date(s: str):
+    """Parse a date candidate with strptime, falling back to dateutil. Returns a date or None."""
+    if '/' in s or '-' in s:
+        for fmt in _FAST_DATE_FORMATS:
+            try:
+                return datetime.strptime(s, fmt).date()
+            except ValueError:
+                continue
+    try:
+        return dtparser.parse(s, dayfirst=True, fuzzy=True).date()
+    except Exception:
+        return None
 
 
 def extract_fields(raw_text: str) -> dict:
@@ -254,7 +334,6 @@ def extract_fields(raw_text: str) -> dict:
     # normalize and uppercase for matching but keep original for supplier heuristics
     norm = _norm_text(text)
     up = norm.upper()
-    lines = [ln.strip() for ln in up.splitlines() if ln.strip()]
 
     out = {
         "supplier": None,
@@ -265,25 +344,25 @@ def extract_fields(raw_text: str) -> dict:
     }
 
     # 1) Supplier heuristic: top block before first heading (INVOICE/TAX INVOICE)
-    first_invoice_idx = None
-    for i, ln in enumerate(lines):
-        if re.search(r'\b(TAX INVOICE|TAXINVOICE|INVOICE|INVOICE NO|INVOICE#)\b', ln):
-            first_invoice_idx = i
-            break
-    if first_invoice_idx is None:
+    heading = _HEADING_RE.search(up)
+    if heading is None:
         # fallback: look for GSTIN; supplier is 2-3 lines above GSTIN
+        lines = [ln.strip() for ln in up.splitlines() if ln.strip()]
         gi = next(((i, l) for i, l in enumerate(lines) if 'GSTIN' in l or _GSTIN_RE.search(l)), None)
         if gi:
             i = gi[0]
             candidate = ' '.join(lines[max(0, i-3):i])
             out['supplier'] = candidate.title()
     else:
-        supplier_block = ' '.join(lines[:first_invoice_idx])
+        # only the lines above the heading line are needed; the trailing 'x'
+        # turns the heading line's own prefix into a last element to drop
+        head_lines = (up[:heading.start()] + 'x').splitlines()[:-1]
+        supplier_block = ' '.join(ln.strip() for ln in head_lines if ln.strip())
         out['supplier'] = supplier_block.title() if supplier_block else None
 
     # 2) Invoice number: search patterns across whole doc
     for pat in _INVOICE_PATTERNS:
-        m = re.search(pat, up, flags=re.IGNORECASE)
+        m = pat.search(up)
         if m:
             out['invoice_number'] = m.group(1).strip()
             break
@@ -291,27 +370,25 @@ def extract_fields(raw_text: str) -> dict:
     # 3) Dates: collect all candidates and choose earliest plausible
     date_candidates = []
     for pat in _DATE_PATTERNS:
-        for m in re.findall(pat, up, flags=re.IGNORECASE):
+        for m in pat.findall(up):
             s = m.strip(' .,:')
-            try:
-                parsed = dtparser.parse(s, dayfirst=True, fuzzy=True)
-                date_candidates.append(parsed.date())
-            except Exception:
-                continue
+            parsed = _fast_parse_date(s)
+            if parsed is not None:
+                date_candidates.append(parsed)
     if date_candidates:
-        out['date'] = sorted(date_candidates)[0].isoformat()
+        out['date'] = min(date_candidates).isoformat()
     else:
         out['date'] = None
 
     # 4) Totals: keyword-first, fallback to largest monetary number
     total_candidates = []
     for pat in _TOTAL_PATTERNS:
-        for m in re.finditer(pat, up, flags=re.IGNORECASE | re.M):
+        for m in pat.finditer(up):
             val = _clean_money(m.group(2))
             if val is not None:
                 total_candidates.append(('keyword', val, m.start()))
     if not total_candidates:
-        money_pairs = re.findall(r'₹?\s*([0-9][0-9,\. ]{1,}[0-9])', up)
+        money_pairs = _MONEY_RE.findall(up)
         for s in money_pairs:
             v = _clean_money(s)
             if v is not None:
@@ -325,24 +402,17 @@ def extract_fields(raw_text: str) -> dict:
 
     # 5) GST: aggregate tax components or pick reported total tax
     gst_amounts = []
+    has_total_tax = False
     for pat in _GST_LINE_PATTERNS:
-        for m in re.finditer(pat, up, flags=re.IGNORECASE):
-            grp = None
-            if len(m.groups()) >= 2:
-                grp = m.groups()[-1]
-            else:
-                grp = m.group(0)
-            v = _clean_money(grp)
+        if pat is _GST_COMPONENT_RE and has_total_tax:
+            # CGST/SGST/IGST are already part of the reported total tax
+            break
+        for m in pat.finditer(up):
+            v = _clean_money(m.group(2))
             if v is not None:
                 gst_amounts.append(v)
-    if gst_amounts:
-        out['gst'] = float(sum(gst_amounts))
-    else:
-        m = re.search(r'(total\s*tax[:\-\s]*)([0-9,\.\s]+)', up, flags=re.IGNORECASE)
-        if m:
-            out['gst'] = _clean_money(m.group(2))
-        else:
-            out['gst'] = None
+                has_total_tax = has_total_tax or pat is _TOTAL_TAX_RE
+    out['gst'] = float(sum(gst_amounts)) if gst_amounts else None
 
     if out['supplier'] and len(out['supplier']) < 3:
         out['supplier'] = None
@@ -362,7 +432,8 @@ PARSED_DIR.mkdir(parents=True, exist_ok=True)
 
 def parse_file(path: Path):
     raw = path.read_text(encoding='utf-8', errors='ignore')
-    raw_norm = '\n'.join([ln.rstrip() for ln in raw.splitlines() if ln.strip()])
+    # drop blank lines and trailing spaces; a line is blank iff its rstrip() is empty
+    raw_norm = '\n'.join(filter(None, map(str.rstrip, raw.splitlines())))
 
     fields = extract_fields(raw)
     parsed = {
@@ -383,40 +454,50 @@ def main(force=False):
         print("No OCR .txt files found in", OCR_DIR)
         return
 
-    for t in txt_files:
-        out_file = PARSED_DIR / (t.stem + ".json")
+    # one directory read instead of a stat per OCR file
+    with os.scandir(PARSED_DIR) as it:
+        existing = {e.name[:-5] for e in it if e.name.endswith('.json')}
 
-        if out_file.exists() and not force:
+    todo = []
+    for t in txt_files:
+        if t.stem in existing and not force:
             print("Skipping (already parsed):", t.name)
             continue
 
         print("Parsing:", t.name)
-        parsed = parse_file(t)
+        todo.append(t)
+
+    # parse_file is CPU-bound and independent per file; writes and the
+    # Sheets batch stay on this process
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+        results = list(ex.map(parse_file, todo, chunksize=8))
+
+    sheet_batch = []
+    for t, parsed in zip(todo, results):
+        out_file = PARSED_DIR / (t.stem + ".json")
         # ---- PHASE 8 LOGGING ----
-required_fields = ['total', 'invoice_number']
-has_failure = any(parsed.get(f) in [None, "", 0] for f in required_fields)
+        required_fields = ['total', 'invoice_number']
+        has_failure = any(parsed.get(f) in [None, "", 0] for f in required_fields)
+        payload = orjson.dumps(parsed, option=orjson.OPT_INDENT_2)
 
-if has_failure:
-    logging.info("PARSE_FAIL %s %s", t.name, parsed)
+        if has_failure:
+            logging.info("PARSE_FAIL %s %s", t.name, parsed)
 
-    failure_dir = PROJECT_ROOT / "data" / "parser_failures"
-    failure_dir.mkdir(parents=True, exist_ok=True)
+            failure_dir = PROJECT_ROOT / "data" / "parser_failures"
+            failure_dir.mkdir(parents=True, exist_ok=True)
 
-    failure_path = failure_dir / (t.stem + ".json")
-    with open(failure_path, "w", encoding="utf-8") as f:
-        json.dump(parsed, f, indent=2, ensure_ascii=False)
-# ------------
-        
+            failure_path = failure_dir / (t.stem + ".json")
+            failure_path.write_bytes(payload)
+        # ------------
 
-        out_file.write_text(
-            json.dumps(parsed, indent=2, ensure_ascii=False),
-            encoding="utf-8"
-        )
+        out_file.write_bytes(payload)
         print("Wrote:", out_file.relative_to(PROJECT_ROOT))
+        sheet_batch.append(parsed)
 
-        # --- Export to Google Sheets ---
+    # --- Export to Google Sheets (one append for the whole run) ---
+    if sheet_batch:
         try:
-            append_to_google_sheet(parsed)
+            append_rows_to_google_sheet(sheet_batch)
         except Exception as e:
             print("Google Sheets append failed:", e)
 
@@ -1,30 +1,56 @@
 import os
-import json
+import atexit
 import logging
+import threading
 import time
 import random
+from pathlib import Path
+from collections import defaultdict
+import orjson
+from google.auth.transport.requests import AuthorizedSession
 from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import GOOGLE_CREDS
+from utils.rate_limit import SHEETS_WRITES
 
 logging.basicConfig(level=logging.INFO)
 
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
-CREDS = json.loads(os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON"))
+SHEETS_API = "https://sheets.googleapis.com/v4/spreadsheets"
 
-SERVICE = None
+# one pooled, token-refreshing session for every append (flusher thread and
+# request threads alike), so retries and batches reuse the same TLS connections
+SESSION = None
 
-def get_service():
-    global SERVICE
-    if SERVICE is None:
-        creds = Credentials.from_service_account_info(CREDS, scopes=SCOPES)
-        SERVICE = build("sheets", "v4", credentials=creds, cache_discovery=False)
-    return SERVICE
+# queued rows are flushed per sheet every FLUSH_INTERVAL seconds or FLUSH_ROWS rows,
+# one append call per sheet, to stay clear of the 60 writes/min quota
+FLUSH_INTERVAL = 2.0
+FLUSH_ROWS = 50
 
-def append_invoice_row(parsed: dict, sheet_id: str, retries=3):
-    service = get_service()
+# quota hits and server errors are worth retrying; other 4xx will fail again
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# rows the API rejected outright are parked here for retry_failed.py
+FAILED_DIR = Path("data/failed_appends")
+ROW_FIELDS = ["invoice_number", "date", "supplier", "total", "raw_text"]
 
-    row = [
+PENDING = defaultdict(list)
+PENDING_LOCK = threading.Lock()
+FLUSHER = None
+
+def get_session():
+    global SESSION
+    if SESSION is None:
+        creds = Credentials.from_service_account_info(GOOGLE_CREDS, scopes=SCOPES)
+        SESSION = AuthorizedSession(creds)
+        SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+    return SESSION
+
+def _invoice_row(parsed: dict) -> list:
+    return [
         parsed.get("invoice_number", ""),
         parsed.get("date", ""),
         parsed.get("supplier", ""),
@@ -32,24 +58,93 @@ def append_invoice_row(parsed: dict, sheet_id: str, retries=3):
         parsed.get("raw_text", "")[:500],
     ]
 
-    body = {"values": [row]}
+def _retryable(e: Exception) -> bool:
+    # errors without an HTTP status (timeouts, resets, exhausted retries) are transient
+    return not isinstance(e, requests.HTTPError) or e.response.status_code in RETRY_STATUSES
+
+def _append_rows(rows: list[list], sheet_id: str, retries=3):
+    session = get_session()
+
+    url = f"{SHEETS_API}/{sheet_id}/values/Sheet1!A:E:append"
+    params = {"valueInputOption": "RAW", "insertDataOption": "INSERT_ROWS"}
+    body = {"values": rows}
 
     for attempt in range(1, retries + 1):
         try:
-            service.spreadsheets().values().append(
-                spreadsheetId=sheet_id,
-                range="Sheet1!A:E",
-                valueInputOption="RAW",
-                insertDataOption="INSERT_ROWS",
-                body=body,
-            ).execute()
-
-            logging.info("✅ SHEET APPEND SUCCESS")
+            SHEETS_WRITES.acquire()
+            resp = session.post(url, params=params, json=body, timeout=30)
+            resp.raise_for_status()
+
+            logging.info("✅ SHEET APPEND SUCCESS (%d rows)", len(rows))
             return
 
-        except Exception:
+        except Exception as e:
             logging.exception("❌ Sheets append failed (%d)", attempt)
+            # the HTTPError (and its status) goes to the caller to decide on
+            if not _retryable(e):
+                raise
+
+        if attempt < retries:
             time.sleep(2 ** attempt + random.random())
 
     raise RuntimeError("Sheets append failed")
 
+def append_invoice_row(parsed: dict, sheet_id: str, retries=3):
+    _append_rows([_invoice_row(parsed)], sheet_id, retries)
+
+def _dead_letter(rows: list[list], sheet_id: str):
+    FAILED_DIR.mkdir(parents=True, exist_ok=True)
+    stamp = time.time_ns()
+    for i, row in enumerate(rows):
+        record = dict(zip(ROW_FIELDS, row), sheet_id=sheet_id)
+        path = FAILED_DIR / f"{stamp}_{i}.json"
+        tmp = path.with_suffix(".json.tmp")
+        tmp.write_bytes(orjson.dumps(record, option=orjson.OPT_INDENT_2))
+        os.replace(tmp, path)
+
+def flush_pending():
+    with PENDING_LOCK:
+        batches = dict(PENDING)
+        PENDING.clear()
+
+    for sheet_id, rows in batches.items():
+        try:
+            try:
+                _append_rows(rows, sheet_id)
+            except Exception as e:
+                if _retryable(e):
+                    raise
+                logging.error("❌ Flush rejected for %s (%s); moving %d rows to %s",
+                              sheet_id, e.response.status_code, len(rows), FAILED_DIR)
+                _dead_letter(rows, sheet_id)
+        except Exception:
+            # transient API errors, and a dead-letter write that failed, alike:
+            # the rows go back to the head of the queue for the next flush
+            logging.exception("❌ Flush failed for %s; re-queueing %d rows", sheet_id, len(rows))
+            with PENDING_LOCK:
+                PENDING[sheet_id][:0] = rows
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        # FLUSHER is started only once, so this thread must outlive any error
+        try:
+            flush_pending()
+        except Exception:
+            logging.exception("❌ Sheets flush crashed")
+
+def queue_invoice_row(parsed: dict, sheet_id: str):
+    """
+    Buffer a row for sheet_id; a background thread appends buffered rows in batches.
+    """
+    global FLUSHER
+    with PENDING_LOCK:
+        PENDING[sheet_id].append(_invoice_row(parsed))
+        full = len(PENDING[sheet_id]) >= FLUSH_ROWS
+        if FLUSHER is None:
+            FLUSHER = threading.Thread(target=_flush_loop, name="sheets-flusher", daemon=True)
+            FLUSHER.start()
+            atexit.register(flush_pending)
+
+    if full:
+        flush_pending()
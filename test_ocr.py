@@ -1,5 +1,7 @@
 # test_ocr.py — simple pytesseract test
-from PIL import Image, ImageOps, ImageFilter
+from PIL import Image
+import cv2
+import numpy as np
 import pytesseract, os, sys
 
 IMAGE = r"C:\Users\irfan\invoice-mvp\data\media\MMf05ee48c1350465581d9aaef5e6af395_0.jpg"
@@ -7,22 +9,37 @@ IMAGE = r"C:\Users\irfan\invoice-mvp\data\media\MMf05ee48c1350465581d9aaef5e6af3
 # make sure pytesseract points to the installed exe
 pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
+# LSTM engine only, one uniform block of text (receipts/invoices), keep column spacing
+TESS_CONFIG = "--oem 1 --psm 6 -c preserve_interword_spaces=1"
+
+# set OCR_DEBUG=1 to also write the preprocessed image (PNG encode + disk write)
+DEBUG = bool(os.getenv("OCR_DEBUG"))
+
 print("Using tesseract:", pytesseract.pytesseract.tesseract_cmd)
 img = Image.open(IMAGE)
 
 # raw OCR
-raw = pytesseract.image_to_string(img, lang="eng")
+raw = pytesseract.image_to_string(img, lang="eng", config=TESS_CONFIG)
 print("RAW OCR repr:")
 print(repr(raw))
 print("-" * 40)
 
-# basic preprocessing and OCR
-img2 = img.convert("L")
-img2 = ImageOps.autocontrast(img2, cutoff=2)
-img2 = img2.filter(ImageFilter.SHARPEN)
-debug_path = os.path.join("data", "ocr", "__debug_img.png")
-img2.save(debug_path)
-print("Saved debug image to:", debug_path, "size:", os.path.getsize(debug_path))
-proc = pytesseract.image_to_string(img2, lang="eng")
+# basic preprocessing and OCR (OpenCV: local contrast via CLAHE, then a light sharpen;
+# no binarization, it tends to hurt Tesseract on photos)
+img2 = cv2.imread(IMAGE, cv2.IMREAD_GRAYSCALE)
+# Tesseract wants taller glyphs than a phone photo usually gives: upscale up to 2x,
+# but keep the long side under MAX_SIDE so OCR time stays bounded
+MAX_SIDE = 2500
+scale = min(2.0, MAX_SIDE / max(img2.shape[:2]))
+if scale > 1:
+    img2 = cv2.resize(img2, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+img2 = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(img2)
+SHARPEN = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]], dtype=np.float32)
+img2 = cv2.filter2D(img2, -1, SHARPEN)
+if DEBUG:
+    debug_path = os.path.join("data", "ocr", "__debug_img.png")
+    cv2.imwrite(debug_path, img2)
+    print("Saved debug image to:", debug_path, "size:", os.path.getsize(debug_path))
+proc = pytesseract.image_to_string(img2, lang="eng", config=TESS_CONFIG)
 print("PROC OCR repr:")
 print(repr(proc))
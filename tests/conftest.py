@@ -0,0 +1,7 @@
+import os
+
+# config.py reads these once, at first import, and webhook_app refuses to
+# import without them; set them before any test module pulls config in
+os.environ.setdefault("TWILIO_ACCOUNT_SID", "ACtest")
+os.environ.setdefault("TWILIO_AUTH_TOKEN", "test")
+os.environ.setdefault("DEFAULT_SHEET_ID", "test-sheet")
@@ -0,0 +1,53 @@
+from pathlib import Path
+
+import pytest
+
+ocr_worker = pytest.importorskip("ocr_worker")
+from google.cloud import vision
+
+
+class FakeVision:
+    """Answers batch_annotate_files like Vision: pages 1-5 when none are named."""
+
+    def __init__(self, total_pages):
+        self.total_pages = total_pages
+        self.calls = []
+
+    def batch_annotate_files(self, requests):
+        pages = list(requests[0].pages)
+        self.calls.append(pages)
+        if any(p > self.total_pages for p in pages):
+            return vision.BatchAnnotateFilesResponse(responses=[
+                vision.AnnotateFileResponse(error={"message": "Invalid page number"})
+            ])
+        served = pages or range(1, min(5, self.total_pages) + 1)
+        return vision.BatchAnnotateFilesResponse(responses=[
+            vision.AnnotateFileResponse(
+                total_pages=self.total_pages,
+                responses=[
+                    vision.AnnotateImageResponse(full_text_annotation={"text": f"page {p}"})
+                    for p in served
+                ],
+            )
+        ])
+
+
+@pytest.fixture
+def fake_vision(monkeypatch):
+    def install(total_pages):
+        client = FakeVision(total_pages)
+        monkeypatch.setattr(ocr_worker, "_PDFIUM_ENABLED", False)
+        monkeypatch.setattr(ocr_worker, "get_vision_client", lambda: client)
+        return client
+    return install
+
+def test_single_page_pdf_leaves_pages_unset(fake_vision):
+    client = fake_vision(1)
+    assert ocr_worker.ocr_pdf(Path("one.pdf"), b"%PDF") == "page 1"
+    assert client.calls == [[]]
+
+def test_seven_page_pdf_asks_for_the_rest_by_number(fake_vision):
+    client = fake_vision(7)
+    text = ocr_worker.ocr_pdf(Path("seven.pdf"), b"%PDF")
+    assert text.splitlines() == [f"page {p}" for p in range(1, 8)]
+    assert client.calls == [[], [6, 7]]
@@ -29,3 +29,14 @@ def test_examples_param(raw, expect_total, expect_date, note):
     assert (out['total'] is None) or abs(out['total'] - expect_total) < 1, f"Total mismatch in {note}"
     if out['date']:
         assert out['date'].startswith(expect_date[:10]), f"Date mismatch in {note}"
+
+def test_ocr_fixes_stay_inside_tokens():
+    # an "ll" token must not turn every l in the document into 1 ("Bill" -> "Bi11")
+    out = extract_fields("Bill No: 77\nll items\nTotal Tax 18.00\nTotal 118.00")
+    assert out['invoice_number'] == '77'
+    assert out['gst'] == 18.0
+
+def test_total_tax_not_summed_with_components():
+    # CGST/SGST make up the reported total tax; adding them again doubles the GST
+    out = extract_fields("Total Tax 36.00\nCGST 18.00\nSGST 18.00\nTotal 236.00")
+    assert out['gst'] == 36.0
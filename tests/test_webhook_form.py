@@ -0,0 +1,28 @@
+import pytest
+
+# env settings webhook_app needs at import come from conftest.py
+webhook_app = pytest.importorskip("webhook_app")
+from fastapi.testclient import TestClient
+
+
+@pytest.mark.parametrize("num_media", ["", "0"])
+def test_empty_num_media_is_no_media(num_media):
+    form = webhook_app.TwilioWebhook.model_validate({"NumMedia": num_media})
+    assert form.NumMedia == 0
+    assert form.media() == []
+
+def test_webhook_ignores_blank_num_media():
+    resp = TestClient(webhook_app.app).post("/webhook/whatsapp", data={"NumMedia": ""})
+    assert resp.status_code == 200
+    assert resp.json() == {"status": "ignored"}
+
+def test_media_urls_come_from_numbered_fields():
+    form = webhook_app.TwilioWebhook.model_validate({
+        "NumMedia": "2",
+        "MediaUrl0": "https://api.twilio.com/m0", "MediaContentType0": "application/pdf",
+        "MediaUrl1": "https://api.twilio.com/m1",
+    })
+    assert form.media() == [
+        ("https://api.twilio.com/m0", "application/pdf"),
+        ("https://api.twilio.com/m1", None),
+    ]
@@ -1,10 +1,13 @@
-import os
-import json
 import logging
+import threading
+import time
 
 from google.oauth2.service_account import Credentials
 from googleapiclient.discovery import build
 
+from config import GOOGLE_CREDS
+from utils.rate_limit import SHEETS_READS
+
 logging.basicConfig(level=logging.INFO)
 
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
@@ -17,33 +20,69 @@ USER_REGISTRY_SHEET_ID = "PASTE_USER_REGISTRY_SHEET_ID"
 # B = sheet_id
 USER_REGISTRY_RANGE = "Sheet1!A:B"
 
+# whatsapp_number -> sheet_id for the whole registry; it rarely changes, so the
+# sheet is fetched at most once per REGISTRY_TTL, or REGISTRY_MISS_TTL when a
+# number is missing (so unregistered senders can't force a read per message)
+REGISTRY_TTL = 300
+REGISTRY_MISS_TTL = 30
+_REGISTRY: dict[str, str] = {}
+_REGISTRY_TS = 0.0
+# also serialises use of SERVICE (httplib2 underneath is not thread-safe)
+_REGISTRY_LOCK = threading.Lock()
+
+SERVICE = None
+
 
 def _get_service():
-    creds_raw = os.getenv("GOOGLE_APPLICATION_CREDENTIALS_JSON")
-    creds_info = json.loads(creds_raw)
-    creds = Credentials.from_service_account_info(creds_info, scopes=SCOPES)
-    return build("sheets", "v4", credentials=creds, cache_discovery=False)
+    global SERVICE
+    if SERVICE is None:
+        creds = Credentials.from_service_account_info(GOOGLE_CREDS, scopes=SCOPES)
+        SERVICE = build("sheets", "v4", credentials=creds, cache_discovery=False)
+    return SERVICE
 
 
 def get_sheet_id_for_user(from_number: str) -> str | None:
     """
     Lookup Google Sheet ID for a WhatsApp sender.
     Returns None if user not registered.
+    The registry is cached for REGISTRY_TTL seconds; a number missing from the
+    cache triggers a refetch if the cache is older than REGISTRY_MISS_TTL, so new
+    registrations show up within that window.
     """
+    global _REGISTRY, _REGISTRY_TS
+    # hits are served without the lock, so a refetch never blocks them
+    if time.monotonic() - _REGISTRY_TS < REGISTRY_TTL:
+        sheet_id = _REGISTRY.get(from_number)
+        if sheet_id is not None:
+            return sheet_id
+
+    with _REGISTRY_LOCK:
+        # another thread may have refetched while this one waited for the lock
+        age = time.monotonic() - _REGISTRY_TS
+        if age >= REGISTRY_TTL or (from_number not in _REGISTRY and age >= REGISTRY_MISS_TTL):
+            _REGISTRY = _load_registry()
+            _REGISTRY_TS = time.monotonic()
+        sheet_id = _REGISTRY.get(from_number)
+
+    if sheet_id is None:
+        logging.warning("❌ No sheet registered for %s", from_number)
+    return sheet_id
+
+
+@SHEETS_READS.limit
+def _load_registry() -> dict[str, str]:
     svc = _get_service()
     res = svc.spreadsheets().values().get(
         spreadsheetId=USER_REGISTRY_SHEET_ID,
         range=USER_REGISTRY_RANGE
     ).execute()
 
-    rows = res.get("values", [])
-
-    for row in rows:
+    registry = {}
+    for row in res.get("values", []):
         if len(row) < 2:
             continue
-        if row[0].strip() == from_number:
-            logging.info("📘 Found sheet for %s", from_number)
-            return row[1].strip()
+        # first row wins, as with the old top-down scan
+        registry.setdefault(row[0].strip(), row[1].strip())
 
-    logging.warning("❌ No sheet registered for %s", from_number)
-    return None
+    logging.info("📘 Loaded %d registered numbers", len(registry))
+    return registry
@@ -1,16 +1,37 @@
+import time
+import threading
 from datetime import datetime
 from utils.customers import load_customers, save_customers
 from utils.manager_sheets import create_customer_sheet
 
+# customer_id -> sheet_id; rebuilt from customers.json on a miss or once older
+# than CACHE_TTL, so edits to the file are picked up within that window
+CACHE_TTL = 60
+_CACHE: dict[str, str] = {}
+_CACHE_TS = 0.0
+# one creator at a time, so two webhooks can't make two sheets for one customer
+_LOCK = threading.Lock()
+
 def get_sheet_for_customer(customer_id):
-    customers = load_customers()
+    global _CACHE, _CACHE_TS
+    if time.monotonic() - _CACHE_TS < CACHE_TTL:
+        sheet_id = _CACHE.get(customer_id)
+        if sheet_id is not None:
+            return sheet_id
+
+    with _LOCK:
+        # load_customers re-parses only when the file's mtime changed
+        customers = load_customers()
+        _CACHE = {cid: c["sheet_id"] for cid, c in customers.items()}
+        _CACHE_TS = time.monotonic()
 
-    if customer_id not in customers:
-        sheet_id = create_customer_sheet(customer_id)
-        customers[customer_id] = {
-            "sheet_id": sheet_id,
-            "created_at": datetime.utcnow().isoformat()
-        }
-        save_customers(customers)
+        if customer_id not in customers:
+            sheet_id = create_customer_sheet(customer_id)
+            customers[customer_id] = {
+                "sheet_id": sheet_id,
+                "created_at": datetime.utcnow().isoformat()
+            }
+            save_customers(customers)
+            _CACHE[customer_id] = sheet_id
 
-    return customers[customer_id]["sheet_id"]
+        return _CACHE[customer_id]
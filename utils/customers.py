@@ -1,17 +1,35 @@
+import os
 import json
 from pathlib import Path
 
 CUSTOMER_FILE = Path("data/customers.json")
 
+# last parsed contents of CUSTOMER_FILE, reused while its mtime is unchanged
+_CACHE = None
+_MTIME = None
+
 def load_customers():
-    if CUSTOMER_FILE.exists():
-        return json.loads(CUSTOMER_FILE.read_text())
-    return {}
+    global _CACHE, _MTIME
+    try:
+        mtime = CUSTOMER_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    if mtime != _MTIME:
+        _CACHE = json.loads(CUSTOMER_FILE.read_text())
+        _MTIME = mtime
+    # callers add customers to the returned dict before saving it
+    return dict(_CACHE)
 
 def save_customers(customers):
-    CUSTOMER_FILE.write_text(
+    global _CACHE, _MTIME
+    # write beside the file and rename, so a crash never leaves half a JSON
+    tmp = CUSTOMER_FILE.with_suffix(".json.tmp")
+    tmp.write_text(
         json.dumps(customers, indent=2)
     )
+    os.replace(tmp, CUSTOMER_FILE)
+    _CACHE = dict(customers)
+    _MTIME = CUSTOMER_FILE.stat().st_mtime_ns
 
 def normalize_whatsapp(from_field):
     return from_field.replace("whatsapp:+", "").strip()
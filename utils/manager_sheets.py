@@ -1,14 +1,25 @@
 import gspread
 from google.oauth2.service_account import Credentials
 
+from utils.rate_limit import SHEETS_WRITES
+
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 CREDS_FILE = "service_account.json"  # same one you already use
 
+GC = None
+
+def get_client():
+    global GC
+    if GC is None:
+        creds = Credentials.from_service_account_file(
+            CREDS_FILE, scopes=SCOPES
+        )
+        GC = gspread.authorize(creds)
+    return GC
+
+@SHEETS_WRITES.limit
 def create_customer_sheet(customer_id):
-    creds = Credentials.from_service_account_file(
-        CREDS_FILE, scopes=SCOPES
-    )
-    gc = gspread.authorize(creds)
+    gc = get_client()
 
     sheet = gc.create(f"Invoice_Data_{customer_id}")
     ws = sheet.sheet1
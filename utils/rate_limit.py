@@ -0,0 +1,40 @@
+import time
+import threading
+from functools import wraps
+
+class TokenBucket:
+    """
+    Blocking token bucket: refills `rate` tokens per second up to `capacity`.
+    acquire() takes one token, sleeping until it is available.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            # reserve the token now (possibly going negative) so waiters queue up
+            # behind each other instead of all waking at once
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            self._tokens -= 1
+        if wait:
+            time.sleep(wait)
+
+    def limit(self, fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            self.acquire()
+            return fn(*args, **kwargs)
+        return wrapper
+
+# Google Sheets per-user quotas: 60 writes and 300 reads per minute.
+# Buckets are per process; small bursts keep a restart from tripping 429s.
+SHEETS_WRITES = TokenBucket(rate=60 / 60, capacity=10)
+SHEETS_READS = TokenBucket(rate=300 / 60, capacity=50)
@@ -1,23 +1,61 @@
-import sys
-print("🚨 WEBHOOK_APP.PY LOADED 🚨", file=sys.stderr)
-
 import os
 import time
+import atexit
+import queue
+import asyncio
 import logging
-import requests
+import logging.handlers
+import tempfile
+import httpx
 from pathlib import Path
-from flask import Flask, request, jsonify
+from collections import OrderedDict
+from typing import Annotated
+from functools import lru_cache
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, Form, BackgroundTasks
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 
-from ocr_worker import process_file
-from sheets import append_invoice_row
+from config import TWILIO_SID, TWILIO_TOKEN, DEFAULT_SHEET_ID
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+# optional: lets concurrent media fetches share one HTTP/2 connection
+try:
+    import h2  # noqa: F401
+    _HTTP2_ENABLED = True
+except Exception:
+    _HTTP2_ENABLED = False
 
-# ================= ENV =================
+# failures also land in data/logs/error.log
+ERROR_LOG = Path("data/logs/error.log")
+ERROR_LOG.parent.mkdir(parents=True, exist_ok=True)
+
+_log_format = logging.Formatter("%(asctime)s %(levelname)s %(message)s")
+_console = logging.StreamHandler()
+_console.setFormatter(_log_format)
+_error_file = logging.handlers.RotatingFileHandler(
+    ERROR_LOG, maxBytes=10_000_000, backupCount=5, encoding="utf-8"
+)
+_error_file.setFormatter(_log_format)
+_error_file.addFilter(logging.Filter("errors"))
+
+# request handlers and workers only enqueue records; one listener thread does
+# all console and file writes, so a slow stderr never stalls the event loop
+_log_queue = queue.Queue(-1)
+_log_listener = logging.handlers.QueueListener(
+    _log_queue, _console, _error_file, respect_handler_level=True
+)
+_log_listener.start()
+# drain whatever is still queued when the worker exits
+atexit.register(_log_listener.stop)
+_enqueue = logging.handlers.QueueHandler(_log_queue)
+# prepare() bakes the message (and any traceback) in; the listener adds the rest
+_enqueue.setFormatter(logging.Formatter("%(message)s"))
+logging.basicConfig(level=logging.INFO, handlers=[_enqueue])
 
-TWILIO_SID = os.getenv("TWILIO_ACCOUNT_SID")
-TWILIO_TOKEN = os.getenv("TWILIO_AUTH_TOKEN")
-DEFAULT_SHEET_ID = os.getenv("DEFAULT_SHEET_ID")
+error_log = logging.getLogger("errors")
+
+# ================= ENV =================
 
 if not TWILIO_SID or not TWILIO_TOKEN:
     raise RuntimeError("Twilio credentials missing")
@@ -25,70 +63,213 @@ if not TWILIO_SID or not TWILIO_TOKEN:
 if not DEFAULT_SHEET_ID:
     raise RuntimeError("DEFAULT_SHEET_ID missing")
 
-# ================= APP =================
+# ================= TWILIO MEDIA =================
 
-app = Flask(__name__)
+# one pooled client per worker so keep-alive connections to Twilio are reused;
+# the transport retries failed connects, status retries are in download_media
+HTTP = httpx.AsyncClient(
+    auth=(TWILIO_SID, TWILIO_TOKEN),
+    timeout=30,
+    follow_redirects=True,
+    transport=httpx.AsyncHTTPTransport(retries=3, http2=_HTTP2_ENABLED),
+)
 
-MEDIA_DIR = Path("data/media")
-MEDIA_DIR.mkdir(parents=True, exist_ok=True)
+# Twilio answers 404 until freshly sent media is ready, so 404 is retried too
+MEDIA_RETRIES = 6
+MEDIA_RETRY_STATUSES = {404, 429, 500, 502, 503}
 
-# ================= TWILIO MEDIA =================
+# OCR (blocking gRPC + Pillow) and the Sheets queue run here, off the event loop
+WORK_POOL = ThreadPoolExecutor(max_workers=4)
+
+def _archive(data: bytes, dest: Path):
+    # write to a unique temp file beside dest, fsync, then rename, so neither a
+    # crash nor a concurrent retry of the same message leaves a torn file behind
+    with tempfile.NamedTemporaryFile(dir=dest.parent, suffix=".part", delete=False) as f:
+        try:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            # the archive is only read back on a Twilio retry; once the pages are
+            # clean, drop them rather than crowd the page cache
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    os.replace(f.name, dest)
+
+async def download_media(media_url: str, dest: Path) -> bytes:
+    """
+    Fetch a Twilio media item into memory and archive it at dest; returns the bytes
+    so OCR can use them without reading the file back.
+    """
+    # archives are renamed into place only once complete, so an existing file
+    # (a Twilio retry of the same MessageSid) is whole and need not be fetched again
+    if dest.exists() and dest.stat().st_size > 0:
+        logging.info("📦 Media already archived: %s", dest.name)
+        return await asyncio.to_thread(dest.read_bytes)
 
-def download_media(media_url: str, dest: Path, retries=6, delay=2):
     media_url = media_url.rstrip("/") + "/Content"
     logging.info("📎 Fetching media: %s", media_url)
 
-    for attempt in range(1, retries + 1):
-        r = requests.get(
-            media_url,
-            auth=(TWILIO_SID, TWILIO_TOKEN),
-            stream=True,
-            timeout=30,
-        )
+    for attempt in range(1, MEDIA_RETRIES + 1):
+        async with HTTP.stream("GET", media_url) as r:
+            if r.status_code not in MEDIA_RETRY_STATUSES or attempt == MEDIA_RETRIES:
+                r.raise_for_status()
+                # one read of the whole body: no per-chunk loop or rechunking, and
+                # no second copy out of an accumulation buffer
+                data = await r.aread()
+                break
+        logging.warning("⏳ Media not ready (%d, %d/%d)", r.status_code, attempt, MEDIA_RETRIES)
+        await asyncio.sleep(0.5 * 2 ** (attempt - 1))
 
-        if r.status_code == 404:
-            logging.warning("⏳ Media not ready (%d/%d)", attempt, retries)
-            time.sleep(delay)
-            continue
+    # blocking file I/O goes to a thread; plain writes beat aiofiles here anyway.
+    # OCR moves the archive once done, so the write must finish before OCR starts;
+    # a failed write only loses the copy, the bytes still go on to OCR
+    try:
+        await asyncio.to_thread(_archive, data, dest)
+    except OSError:
+        error_log.exception("❌ Media archive failed: %s", dest.name)
 
-        r.raise_for_status()
+    logging.info("📥 Media downloaded")
+    return data
 
-        with open(dest, "wb") as f:
-            for chunk in r.iter_content(16384):
-                if chunk:
-                    f.write(chunk)
+async def _download_one(media_url: str, dest: Path) -> bytes | None:
+    # one failed attachment must not sink the rest of the message
+    try:
+        return await download_media(media_url, dest)
+    except Exception:
+        error_log.exception("❌ Media download failed: %s", media_url)
+        return None
 
-        logging.info("📥 Media downloaded")
-        return True
+# ================= BACKGROUND =================
 
-    logging.warning("❌ Media never became available")
-    return False
+@lru_cache(maxsize=1)
+def _get_deps():
+    # Vision/gRPC, Pillow and the Sheets client are slow to import; load them on
+    # the first message so the worker answers GET / health checks right away
+    from ocr_worker import process_files
+    from sheets import queue_invoice_row
+    return process_files, queue_invoice_row
 
-# ================= ROUTES =================
+def _ocr_and_queue(paths: list[Path], contents: list[bytes]):
+    try:
+        process_files, queue_invoice_row = _get_deps()
+        for parsed in process_files(paths, contents):
+            if parsed is None:
+                continue
+
+            queue_invoice_row(parsed, DEFAULT_SHEET_ID)
+            logging.info("🧾 Queued for Sheets: %s", parsed.get("invoice_number"))
+    except Exception:
+        error_log.exception("❌ Processing failed for %s", [p.name for p in paths])
+
+async def process_message(urls: list[str], paths: list[Path]):
+    if _get_deps.cache_info().currsize == 0:
+        # first message on this worker: import the OCR/Sheets stack while the media
+        # downloads; an import error resurfaces (and is logged) in _ocr_and_queue
+        WORK_POOL.submit(_get_deps)
+
+    # attachments already OCR'd and queued (by any worker) are not done twice
+    todo = [(u, p) for u, p in zip(urls, paths) if not (PROCESSED_DIR / p.name).exists()]
+    if len(todo) < len(urls):
+        logging.info("🔁 Skipping %d already processed attachment(s)", len(urls) - len(todo))
+    if not todo:
+        return
+    urls = [u for u, _ in todo]
+    paths = [p for _, p in todo]
 
-@app.route("/", methods=["GET"])
-def home():
-    return "OK", 200
+    # attachments download concurrently on the event loop
+    results = await asyncio.gather(*(_download_one(u, p) for u, p in zip(urls, paths)))
+    fetched = [(p, data) for p, data in zip(paths, results) if data is not None]
+    if not fetched:
+        logging.warning("⏳ No media downloaded for %s", urls)
+        return
+    paths = [p for p, _ in fetched]
+    contents = [data for _, data in fetched]
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(WORK_POOL, _ocr_and_queue, paths, contents)
+
+# ================= APP =================
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # once per worker at startup, not as an import side effect
+    MEDIA_DIR.mkdir(parents=True, exist_ok=True)
+    yield
+    await HTTP.aclose()
+
+app = FastAPI(lifespan=lifespan)
+
+MEDIA_DIR = Path("data/media")
+# where ocr_worker moves media once its row is queued for Sheets
+PROCESSED_DIR = MEDIA_DIR / "processed"
+
+# MessageSids this worker has already accepted, oldest first; Twilio re-posts a
+# message when it sees no timely answer, and those repeats are dropped. This is
+# per worker; a repeat landing on another worker is caught by PROCESSED_DIR
+SEEN_SIDS = OrderedDict()
+SEEN_SIDS_MAX = 10_000
+
+# ================= FORM =================
+
+class TwilioWebhook(BaseModel):
+    """
+    Twilio's WhatsApp webhook form, parsed and validated once per request.
+    Numbered fields (MediaUrl0, MediaContentType0, ...) are kept as extras.
+    """
+    model_config = ConfigDict(extra="allow")
+
+    NumMedia: int = Field(0, ge=0, le=10)
+    MessageSid: str | None = None
+
+    @field_validator("NumMedia", mode="before")
+    @classmethod
+    def _blank_num_media(cls, v):
+        # Twilio (and the old handler) treat an empty NumMedia as no media
+        return v or 0
+
+    def media(self) -> list[tuple[str, str | None]]:
+        extra = self.model_extra
+        return [
+            (extra[f"MediaUrl{i}"], extra.get(f"MediaContentType{i}"))
+            for i in range(self.NumMedia)
+            if extra.get(f"MediaUrl{i}")
+        ]
+
+# ================= ROUTES =================
 
+@app.get("/", response_class=PlainTextResponse)
+async def home():
+    return "OK"
 
-@app.route("/webhook/whatsapp", methods=["POST"])
-def whatsapp_webhook():
-    media_url = request.form.get("MediaUrl0")
-    if not media_url:
-        return jsonify({"status": "ignored"}), 200
 
-    msg_id = request.form.get("MessageSid", str(int(time.time())))
-    img_path = MEDIA_DIR / f"{msg_id}.jpg"
+@app.post("/webhook/whatsapp")
+async def whatsapp_webhook(form: Annotated[TwilioWebhook, Form()], background: BackgroundTasks):
+    media = form.media()
+    if not media:
+        return {"status": "ignored"}
 
-    ok = download_media(media_url, img_path)
-    if not ok:
-        # IMPORTANT: return 200 so Twilio retries
-        return jsonify({"status": "waiting"}), 200
+    sid = form.MessageSid
+    if sid:
+        if sid in SEEN_SIDS:
+            logging.info("🔁 Duplicate message ignored: %s", sid)
+            return {"status": "duplicate"}
+        SEEN_SIDS[sid] = None
+        if len(SEEN_SIDS) > SEEN_SIDS_MAX:
+            SEEN_SIDS.popitem(last=False)
 
-    parsed = process_file(img_path)
+    msg_id = sid or str(int(time.time()))
+    urls, paths = [], []
+    for i, (url, ctype) in enumerate(media):
+        ext = ".pdf" if ctype == "application/pdf" else ".jpg"
+        urls.append(url)
+        paths.append(MEDIA_DIR / f"{msg_id}_{i}{ext}")
 
-    logging.error("🚨 AFTER OCR — APPENDING TO SHEETS 🚨")
-    append_invoice_row(parsed, DEFAULT_SHEET_ID)
-    logging.error("✅ GOOGLE SHEETS APPEND DONE")
+    # download + OCR + Sheets run after the response is sent, so Twilio gets its
+    # answer fast; 202 says the message was accepted, not yet processed
+    background.add_task(process_message, urls, paths)
 
-    return jsonify({"status": "ok"}), 200
+    return JSONResponse({"status": "queued"}, status_code=202)